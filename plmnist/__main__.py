@@ -4,6 +4,7 @@ import pytorch_lightning as pl
 
 from plmnist.plmnist import train, test, write
 from plmnist.fgsm import fgsm_from_path, plot_fgsm
+from plmnist.export import EXPORT_EXTENSIONS
 from plmnist.config import (
     NUM_EPOCHS,
     LOG_PATH,
@@ -15,6 +16,11 @@ from plmnist.config import (
     DROPOUT_PROB,
     SEED,
     FGSM_EPSILON,
+    ADV_EPSILON,
+    ADV_RATIO,
+    ACCELERATOR,
+    DEVICES,
+    STRATEGY,
 )
 
 
@@ -30,6 +36,15 @@ if __name__ == "__main__":
     parser.add_argument("--dropout_prob", type=float, default=DROPOUT_PROB)
     parser.add_argument("--seed", type=int, default=SEED)
     parser.add_argument("--fgsm_epsilon", type=float, default=FGSM_EPSILON)
+    parser.add_argument("--adv_epsilon", type=float, default=ADV_EPSILON)
+    parser.add_argument("--adv_ratio", type=float, default=ADV_RATIO)
+    parser.add_argument("--accelerator", type=str, default=ACCELERATOR)
+    parser.add_argument("--devices", type=int, default=DEVICES)
+    parser.add_argument("--strategy", type=str, default=STRATEGY)
+    parser.add_argument("--shard_dir", type=str, default=None)
+    parser.add_argument(
+        "--export_format", type=str, default=None, choices=EXPORT_EXTENSIONS
+    )
 
     parser.add_argument("--no_dhash", dest="do_dhash", action="store_false")
     parser.add_argument("--no_fgsm", dest="do_fgsm", action="store_false")
@@ -47,11 +62,27 @@ if __name__ == "__main__":
         hidden_size=args.hidden_size,
         learning_rate=args.learning_rate,
         dropout_prob=args.dropout_prob,
+        adv_epsilon=args.adv_epsilon,
+        adv_ratio=args.adv_ratio,
+        accelerator=args.accelerator,
+        devices=args.devices,
+        strategy=args.strategy,
+        shard_dir=args.shard_dir,
     )
 
+    # with --strategy ddp every rank runs this script; only rank 0 continues
+    if not trainer.is_global_zero:
+        raise SystemExit(0)
+
     results = test(trainer, args.seed)
 
-    dhash = write(results, trainer, directory=args.result_path, do_dhash=args.do_dhash)
+    dhash = write(
+        results,
+        trainer,
+        directory=args.result_path,
+        do_dhash=args.do_dhash,
+        export_format=args.export_format,
+    )
 
     if args.do_fgsm:
         # separate part -- fgsm
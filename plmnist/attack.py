@@ -0,0 +1,191 @@
+import os, json, argparse
+
+import torch
+import pytorch_lightning as pl
+import torch.nn.functional as F
+
+from plmnist.plmnist import LitMNIST
+from plmnist.model import PIXEL_BOUNDS
+from plmnist.evaluate import cached_clean_eval, clean_eval_path
+from plmnist.status import record, results_scalars
+from plmnist.config import (
+    FGSM_EPSILON,
+    PGD_STEP_SIZE,
+    PGD_NUM_STEPS,
+    RESULT_PATH,
+    SEED,
+)
+
+
+def _project(x_adv, x, epsilon):
+    # back into the intersection of the epsilon ball around x and the
+    # normalized pixel range (both are boxes, so clamping to each is exact)
+    lower = torch.clamp(x - epsilon, min=PIXEL_BOUNDS[0])
+    upper = torch.clamp(x + epsilon, max=PIXEL_BOUNDS[1])
+    return torch.max(torch.min(x_adv, upper), lower)
+
+
+def pgd(
+    model: pl.LightningModule,
+    epsilon: float = FGSM_EPSILON,
+    step_size: float = PGD_STEP_SIZE,
+    num_steps: int = PGD_NUM_STEPS,
+    random_start: bool = False,
+    clean_eval: dict = None,
+):
+    """Batched iterative attack (PGD, or BIM without ``random_start``).
+
+    Each test batch is attacked as a whole. Only images that are correctly
+    classified are attacked, and images that already fool the model drop out
+    of the remaining steps. Returns the same ``(accuracy, examples, epsilon)``
+    tuple as ``fgsm()``.
+    """
+    total, correct, adv_examples = 0, 0, []
+    offset = 0
+    for data, target in model.test_dataloader():
+        data, target = data.to(model.device), target.to(model.device)
+
+        # predict, and skip the images that are already wrong
+        if clean_eval is not None:
+            init_pred = clean_eval["preds"][offset : offset + len(target)]
+            init_pred = init_pred.to(model.device)
+        else:
+            with torch.no_grad():
+                init_pred = torch.argmax(model(data), dim=1)
+        offset += len(target)
+
+        attacked = init_pred == target
+        x, y = data[attacked], target[attacked]
+        total += len(y)
+        if len(y) == 0:
+            continue
+
+        x_adv = x.clone()
+        if random_start:
+            x_adv = _project(x_adv + torch.empty_like(x).uniform_(-epsilon, epsilon), x, epsilon)
+
+        active = torch.ones(len(y), dtype=torch.bool, device=y.device)
+        for _ in range(num_steps):
+            idx = torch.nonzero(active).flatten()
+            if len(idx) == 0:
+                break
+
+            x_step = x_adv[idx].clone().requires_grad_(True)
+            logits = model(x_step)
+
+            # images that already fool the model are not attacked further
+            fooled = torch.argmax(logits, dim=1) != y[idx]
+            active[idx[fooled]] = False
+
+            loss = F.nll_loss(logits, y[idx], reduction="sum")
+            (x_grad,) = torch.autograd.grad(loss, x_step)
+
+            still = ~fooled
+            x_adv[idx[still]] = _project(
+                x_step[still].detach() + step_size * x_grad[still].sign(),
+                x[idx[still]],
+                epsilon,
+            )
+
+        with torch.no_grad():
+            final_pred = torch.argmax(model(x_adv), dim=1)
+
+        correct += (final_pred == y).sum().item()
+
+        for i in torch.nonzero(final_pred != y).flatten()[: 5 - len(adv_examples)]:
+            # save only first 5
+            adv_examples.append(
+                (
+                    y[i].item(),
+                    final_pred[i].item(),
+                    x_adv[i].squeeze().cpu().numpy().tolist(),
+                    x[i].squeeze().cpu().numpy().tolist(),
+                )
+            )
+
+    final_acc = correct / total
+    print(
+        "Epsilon: {}\tSteps: {}\tPGD Accuracy = {} / {} = {}".format(
+            epsilon, num_steps, correct, total, final_acc
+        )
+    )
+
+    return final_acc, adv_examples, epsilon
+
+
+def add_pgd_to_results(
+    pgd: tuple[float, list], step_size: float, num_steps: int, results_path: str
+):
+    if os.path.exists(results_path):
+        with open(results_path, "r") as f:
+            results = json.load(f)
+
+        results["pgd"] = dict()
+        results["pgd"]["accuracy"] = pgd[0]
+        results["pgd"]["examples"] = pgd[1]
+        results["pgd"]["epsilon"] = pgd[2]
+        results["pgd"]["step_size"] = step_size
+        results["pgd"]["num_steps"] = num_steps
+        # the perturbed images are clamped to the normalized pixel range, while
+        # the 'fgsm' entry keeps the upstream [0, 1] clamp in normalized space
+        results["pgd"]["bounds"] = list(PIXEL_BOUNDS)
+
+        with open(results_path, "w") as f:
+            json.dump(results, f)
+
+        record(os.path.dirname(results_path), "pgd", results_path, results_scalars(results))
+    else:
+        raise FileNotFoundError(f"File not found: {results_path}")
+
+
+def pgd_from_path(
+    result_path: str,
+    epsilon: float = FGSM_EPSILON,
+    step_size: float = PGD_STEP_SIZE,
+    num_steps: int = PGD_NUM_STEPS,
+    dhash: str = "",
+    random_start: bool = False,
+    batch_size: int = None,
+):
+    ckpt_path = f"{result_path}/model{dhash}.ckpt"
+    json_path = f"{result_path}/results{dhash}.json"
+
+    model = LitMNIST.load_from_checkpoint(ckpt_path)
+    model.setup("test")
+    model.eval()
+
+    # larger batches attack more images per step
+    if batch_size is not None:
+        model.batch_size = batch_size
+
+    clean_eval = cached_clean_eval(model, ckpt_path, clean_eval_path(result_path, dhash))
+
+    pgd_results = pgd(model, epsilon, step_size, num_steps, random_start, clean_eval)
+    add_pgd_to_results(pgd_results, step_size, num_steps, json_path)
+
+    return pgd_results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--result_path", type=str, default=RESULT_PATH)
+    parser.add_argument("--epsilon", type=float, default=FGSM_EPSILON)
+    parser.add_argument("--step_size", type=float, default=PGD_STEP_SIZE)
+    parser.add_argument("--num_steps", type=int, default=PGD_NUM_STEPS)
+    parser.add_argument("--random_start", action="store_true")
+    parser.add_argument("--batch_size", type=int, default=None)
+    parser.add_argument("--dhash", type=str, default="")
+    args = parser.parse_args()
+
+    pl.seed_everything(args.seed)
+
+    pgd_from_path(
+        args.result_path,
+        args.epsilon,
+        args.step_size,
+        args.num_steps,
+        args.dhash,
+        args.random_start,
+        args.batch_size,
+    )
@@ -3,10 +3,26 @@ import os
 DATA_PATH = str(os.environ.get("PLM_DATA_PATH", "./data"))
 LOG_PATH = str(os.environ.get("PLM_LOG_PATH", "./logs"))
 RESULT_PATH = str(os.environ.get("PLM_RESULT_PATH", "./results"))
+SHARD_PATH = str(os.environ.get("PLM_SHARD_PATH", "./shards"))
 NUM_EPOCHS = int(os.environ.get("PLM_NUM_EPOCHS", 3))
 BATCH_SIZE = int(os.environ.get("PLM_BATCH_SIZE", 256))
 HIDDEN_SIZE = int(os.environ.get("PLM_HIDDEN_SIZE", 64))
 LEARNING_RATE = float(os.environ.get("PLM_LEARNING_RATE", 2e-4))
 DROPOUT_PROB = float(os.environ.get("PLM_DROPOUT_PROB", 0.1))
 FGSM_EPSILON = float(os.environ.get("PLM_FGSM_EPSILON", 0.05))
+PGD_STEP_SIZE = float(os.environ.get("PLM_PGD_STEP_SIZE", 0.01))
+PGD_NUM_STEPS = int(os.environ.get("PLM_PGD_NUM_STEPS", 10))
+ADV_EPSILON = float(os.environ.get("PLM_ADV_EPSILON", 0.0))
+ADV_RATIO = float(os.environ.get("PLM_ADV_RATIO", 0.5))
+PRUNE_THRESHOLD = float(os.environ.get("PLM_PRUNE_THRESHOLD", 0.0))
+FINETUNE_STEPS = int(os.environ.get("PLM_FINETUNE_STEPS", 0))
 SEED = int(os.environ.get("PLM_SEED", 42))
+STATUS_INDEX = str(os.environ.get("PLM_STATUS_INDEX", ""))
+LOG_EVERY_N_STEPS = int(os.environ.get("PLM_LOG_EVERY_N_STEPS", 50))
+LOG_FLUSH_SECS = float(os.environ.get("PLM_LOG_FLUSH_SECS", 60.0))
+ACCELERATOR = str(os.environ.get("PLM_ACCELERATOR", "auto"))
+DEVICES = int(os.environ.get("PLM_DEVICES", 1))
+STRATEGY = str(os.environ.get("PLM_STRATEGY", "auto"))
+SHARD_SIZE = int(os.environ.get("PLM_SHARD_SIZE", 10000))
+SHUFFLE_BUFFER_SIZE = int(os.environ.get("PLM_SHUFFLE_BUFFER_SIZE", 10000))
+EXPORT_FORMAT = str(os.environ.get("PLM_EXPORT_FORMAT", "torchscript"))
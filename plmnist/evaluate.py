@@ -0,0 +1,105 @@
+import os, hashlib
+
+import torch
+import pytorch_lightning as pl
+import torch.nn.functional as F
+
+
+def file_hash(path: str):
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def dataset_version(dataset):
+    """Hash of the raw images and labels of an MNIST dataset."""
+    if hasattr(dataset, "fingerprint"):
+        return dataset.fingerprint()
+
+    md5 = hashlib.md5()
+    md5.update(dataset.data.numpy().tobytes())
+    md5.update(dataset.targets.numpy().tobytes())
+    return md5.hexdigest()
+
+
+@torch.no_grad()
+def evaluate_clean(model: pl.LightningModule):
+    """Run the model once over the test set.
+
+    Returns a dict with the (log-softmax) logits, predictions, targets and
+    correctness mask of every test image, plus the mean loss and accuracy.
+    """
+    was_training = model.training
+    model.eval()
+
+    logits, targets = [], []
+    for data, target in model.test_dataloader():
+        logits.append(model(data.to(model.device)).cpu())
+        targets.append(target)
+
+    model.train(was_training)
+
+    logits = torch.cat(logits)
+    targets = torch.cat(targets)
+    preds = torch.argmax(logits, dim=1)
+    correct = preds == targets
+
+    return {
+        "logits": logits,
+        "preds": preds,
+        "targets": targets,
+        "correct": correct,
+        "loss": F.nll_loss(logits, targets).item(),
+        "acc": correct.float().mean().item(),
+    }
+
+
+def clean_eval_path(result_path: str, dhash: str = ""):
+    return f"{result_path}/clean_eval{dhash}.pt"
+
+
+def save_clean_eval(clean_eval: dict, ckpt_path: str, cache_path: str, data_version: str):
+    """Store a clean evaluation next to its checkpoint.
+
+    The cache is keyed on the checkpoint hash and the test dataset version.
+    """
+    torch.save(
+        {
+            **clean_eval,
+            "ckpt_hash": file_hash(ckpt_path),
+            "dataset_version": data_version,
+        },
+        cache_path,
+    )
+
+
+def load_clean_eval(ckpt_path: str, cache_path: str, data_version: str):
+    """Load a cached clean evaluation, or None if it is missing or stale."""
+    if not os.path.exists(cache_path):
+        return None
+
+    clean_eval = torch.load(cache_path)
+    if (
+        clean_eval.get("ckpt_hash") != file_hash(ckpt_path)
+        or clean_eval.get("dataset_version") != data_version
+    ):
+        return None
+
+    return clean_eval
+
+
+def cached_clean_eval(model: pl.LightningModule, ckpt_path: str, cache_path: str):
+    """Return the clean evaluation of a checkpoint, computing and caching it if needed.
+
+    The model must already be loaded from ``ckpt_path`` and set up for testing.
+    """
+    data_version = dataset_version(model.mnist_test)
+
+    clean_eval = load_clean_eval(ckpt_path, cache_path, data_version)
+    if clean_eval is None:
+        clean_eval = evaluate_clean(model)
+        save_clean_eval(clean_eval, ckpt_path, cache_path, data_version)
+
+    return clean_eval
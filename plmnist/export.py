@@ -0,0 +1,179 @@
+import sys, copy, time, argparse, subprocess, warnings
+
+import torch
+import pytorch_lightning as pl
+from torch import nn
+
+from plmnist.model import LitMNIST
+from plmnist.inference import load_exported, onnxruntime
+from plmnist.config import RESULT_PATH, EXPORT_FORMAT, BATCH_SIZE
+
+
+EXPORT_EXTENSIONS = {"torchscript": "pt", "onnx": "onnx"}
+
+
+def _inference_module(model: pl.LightningModule):
+    # the plain nn.Module computed by LitMNIST.forward, without Lightning
+    return nn.Sequential(copy.deepcopy(model.model), nn.LogSoftmax(dim=1)).cpu().eval()
+
+
+def export_model(model: pl.LightningModule, path: str, export_format: str = EXPORT_FORMAT):
+    """Export a frozen inference copy of the model to TorchScript or ONNX."""
+    module = _inference_module(model)
+    example = torch.zeros(1, *model.dims)
+
+    with torch.no_grad():
+        if export_format == "torchscript":
+            traced = torch.jit.freeze(torch.jit.trace(module, example))
+            torch.jit.save(traced, path)
+        elif export_format == "onnx":
+            torch.onnx.export(
+                module,
+                example,
+                path,
+                input_names=["images"],
+                output_names=["log_probs"],
+                dynamic_axes={"images": {0: "batch"}, "log_probs": {0: "batch"}},
+            )
+        else:
+            raise ValueError(f"Unknown export format: {export_format}")
+
+    return path
+
+
+def check_parity(
+    model: pl.LightningModule, path: str, rtol: float = 1e-3, atol: float = 1e-5
+):
+    """Compare the exported and the checkpoint model outputs on one test batch.
+
+    The predicted probabilities are compared (not the log-probabilities, which
+    are large and imprecise for unlikely classes). Returns the max absolute
+    difference and whether it is within ``rtol``/``atol``, and warns if not.
+    """
+    model.setup("test")
+    data, _ = next(iter(model.test_dataloader()))
+
+    with torch.no_grad():
+        expected = _inference_module(model)(data).exp()
+    actual = load_exported(path)(data).exp()
+
+    max_abs_diff = (expected - actual).abs().max().item()
+    parity = torch.allclose(actual, expected, rtol=rtol, atol=atol)
+    if not parity:
+        warnings.warn(
+            f"Exported model {path} does not match the checkpoint: "
+            f"max abs diff of the probabilities = {max_abs_diff}"
+        )
+
+    return max_abs_diff, parity
+
+
+def export_with_parity(
+    model: pl.LightningModule, directory: str, dhash: str = "", export_format: str = EXPORT_FORMAT
+):
+    if export_format == "onnx" and onnxruntime is None:
+        warnings.warn("onnxruntime is not installed, exporting to TorchScript instead")
+        export_format = "torchscript"
+
+    path = f"{directory}/model{dhash}.{EXPORT_EXTENSIONS[export_format]}"
+    export_model(model, path, export_format)
+    max_abs_diff, parity = check_parity(model, path)
+
+    return {
+        "format": export_format,
+        "path": path,
+        "max_abs_diff": max_abs_diff,
+        "parity": parity,
+    }
+
+
+# ┌────────────────────────────────────────────┐
+# │ Benchmark the checkpoint vs exported model │
+# └────────────────────────────────────────────┘
+
+_COLD_LOAD_SNIPPETS = {
+    "checkpoint": (
+        "import torch; from plmnist.model import LitMNIST; "
+        "m = LitMNIST.load_from_checkpoint({path!r}, map_location='cpu').eval(); "
+        "x = torch.zeros(1, *m.dims)\n"
+        "with torch.no_grad(): m(x)"
+    ),
+    "exported": (
+        "import torch; from plmnist.inference import load_exported; "
+        "m = load_exported({path!r}); m(torch.zeros(1, *{dims}))"
+    ),
+}
+
+
+def _cold_load_time(kind: str, path: str, dims: tuple):
+    # a fresh interpreter, so the import time is included
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "-c", _COLD_LOAD_SNIPPETS[kind].format(path=path, dims=dims)],
+        check=True,
+    )
+    return time.perf_counter() - start
+
+
+def batch_latency(predict, x: torch.Tensor, num_batches: int):
+    with torch.no_grad():
+        predict(x)  # warm up
+        start = time.perf_counter()
+        for _ in range(num_batches):
+            predict(x)
+    return (time.perf_counter() - start) / num_batches
+
+
+def benchmark(
+    ckpt_path: str, export_path: str, batch_size: int = BATCH_SIZE, num_batches: int = 100
+):
+    """Time the cold load and per-batch latency of the checkpoint and the exported model."""
+    model = LitMNIST.load_from_checkpoint(ckpt_path, map_location="cpu").eval()
+    exported = load_exported(export_path)
+    x = torch.randn(batch_size, *model.dims)
+
+    results = {
+        "cold_load_sec": {
+            "checkpoint": _cold_load_time("checkpoint", ckpt_path, model.dims),
+            "exported": _cold_load_time("exported", export_path, model.dims),
+        },
+        "batch_latency_sec": {
+            "checkpoint": batch_latency(model, x, num_batches),
+            "exported": batch_latency(exported, x, num_batches),
+        },
+    }
+
+    for key, timings in results.items():
+        print(
+            "{}\tcheckpoint = {:.6f}\texported = {:.6f}".format(
+                key, timings["checkpoint"], timings["exported"]
+            )
+        )
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--result_path", type=str, default=RESULT_PATH)
+    parser.add_argument("--dhash", type=str, default="")
+    parser.add_argument(
+        "--export_format", type=str, default=EXPORT_FORMAT, choices=EXPORT_EXTENSIONS
+    )
+    parser.add_argument("--batch_size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--no_benchmark", dest="do_benchmark", action="store_false")
+    args = parser.parse_args()
+
+    ckpt_path = f"{args.result_path}/model{args.dhash}.ckpt"
+
+    model = LitMNIST.load_from_checkpoint(ckpt_path, map_location="cpu")
+    model.eval()
+
+    export = export_with_parity(model, args.result_path, args.dhash, args.export_format)
+    print(
+        f"Exported {export['path']}: max abs diff = {export['max_abs_diff']}"
+        f"\tparity = {export['parity']}"
+    )
+
+    if args.do_benchmark:
+        benchmark(ckpt_path, export["path"], args.batch_size)
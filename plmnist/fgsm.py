@@ -6,15 +6,28 @@ import torch.nn.functional as F
 import matplotlib.pyplot as plt
 
 from plmnist.plmnist import LitMNIST
+from plmnist.model import fgsm_attack
+from plmnist.evaluate import cached_clean_eval, clean_eval_path
+from plmnist.status import record, results_scalars
 from plmnist.config import FGSM_EPSILON, RESULT_PATH, SEED
 
 
 # based on https://pytorch.org/tutorials/beginner/fgsm_tutorial.html#fgsm-attack
-def fgsm(model: pl.LightningModule, epsilon: float = FGSM_EPSILON):
+def fgsm(
+    model: pl.LightningModule, epsilon: float = FGSM_EPSILON, clean_eval: dict = None
+):
     total, correct, adv_examples = 0, 0, []
+    i = -1
     for batch in model.test_dataloader():
         data, target = batch
         for data_i, target_i in zip(data, target):
+            i += 1
+
+            # skip if the cached clean prediction is wrong; the correct images
+            # still need their clean forward pass below for the gradient
+            if clean_eval is not None and not clean_eval["correct"][i]:
+                continue
+
             total += 1
 
             # predict
@@ -34,7 +47,7 @@ def fgsm(model: pl.LightningModule, epsilon: float = FGSM_EPSILON):
             data_grad = data_i.grad.data
 
             # attack
-            perturbed_data = torch.clamp(data_i + epsilon * data_grad.sign(), 0, 1)
+            perturbed_data = fgsm_attack(data_i, data_grad, epsilon)
 
             # predict on attacked image
             output = model(perturbed_data.unsqueeze(0))
@@ -78,6 +91,8 @@ def add_fgsm_to_results(fgsm: tuple[float, list], results_path: str):
 
         with open(results_path, "w") as f:
             json.dump(results, f)
+
+        record(os.path.dirname(results_path), "fgsm", results_path, results_scalars(results))
     else:
         raise FileNotFoundError(f"File not found: {results_path}")
 
@@ -106,10 +121,12 @@ def fgsm_from_path(result_path: str, epsilon: float = FGSM_EPSILON, dhash: str =
     json_path = f"{result_path}/results{dhash}.json"
 
     model = LitMNIST.load_from_checkpoint(ckpt_path)
-    model.setup()
+    model.setup("test")
     model.eval()
 
-    fgsm_results = fgsm(model, epsilon)
+    clean_eval = cached_clean_eval(model, ckpt_path, clean_eval_path(result_path, dhash))
+
+    fgsm_results = fgsm(model, epsilon, clean_eval)
     add_fgsm_to_results(fgsm_results, json_path)
 
     return fgsm_results
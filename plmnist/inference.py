@@ -0,0 +1,46 @@
+"""Minimal loader for exported plmnist models.
+
+This module does not import PyTorch Lightning, so loading an exported model
+only costs the ``torch`` (or ``onnxruntime``) import and reading the file.
+The inputs are normalized image batches of shape (n, 1, 28, 28), as produced
+by ``LitMNIST.transform``, and the outputs are log-probabilities.
+"""
+import torch
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+
+class ExportedModel:
+    def __init__(self, path: str):
+        self.path = path
+
+        if path.endswith(".onnx"):
+            if onnxruntime is None:
+                raise ImportError("onnxruntime is required to load ONNX models")
+            self._session = onnxruntime.InferenceSession(
+                path, providers=["CPUExecutionProvider"]
+            )
+            self._input_name = self._session.get_inputs()[0].name
+            self._module = None
+        else:
+            self._session = None
+            self._module = torch.jit.load(path, map_location="cpu")
+            self._module.eval()
+
+    @torch.no_grad()
+    def __call__(self, x: torch.Tensor):
+        if self._session is not None:
+            (out,) = self._session.run(None, {self._input_name: x.cpu().numpy()})
+            return torch.from_numpy(out)
+
+        return self._module(x)
+
+    def predict(self, x: torch.Tensor):
+        return torch.argmax(self(x), dim=1)
+
+
+def load_exported(path: str):
+    return ExportedModel(path)
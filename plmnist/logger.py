@@ -0,0 +1,145 @@
+import os, glob, json, time
+
+from pytorch_lightning.loggers.logger import Logger
+from pytorch_lightning.utilities.rank_zero import rank_zero_only
+
+from plmnist.config import LOG_FLUSH_SECS
+
+
+class BufferedLogger(Logger):
+    """Low-overhead replacement for ``CSVLogger``.
+
+    Hyperparameters and metrics are buffered in memory and appended as JSON
+    lines to a single ``metrics.jsonl`` file per run, at most once every
+    ``flush_secs`` seconds (and when training ends). Step-level metrics are
+    sampled by the trainer (``log_every_n_steps``, see ``plmnist.train``).
+
+    Logs are saved to ``os.path.join(save_dir, name, f"version_{version}")``,
+    the same layout as ``CSVLogger``.
+    """
+
+    NAME_METRICS_FILE = "metrics.jsonl"
+
+    def __init__(
+        self,
+        save_dir: str,
+        name: str = "lightning_logs",
+        version: int | None = None,
+        flush_secs: float = LOG_FLUSH_SECS,
+    ):
+        super().__init__()
+        self._save_dir = save_dir
+        self._name = name
+        self._version = version
+        self.flush_secs = flush_secs
+
+        self._buffer = []
+        self._last_flush = time.monotonic()
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def version(self):
+        if self._version is None:
+            self._version = self._get_next_version()
+        return self._version
+
+    @property
+    def save_dir(self):
+        return self._save_dir
+
+    @property
+    def root_dir(self):
+        return os.path.join(self.save_dir, self.name)
+
+    @property
+    def log_dir(self):
+        return os.path.join(self.root_dir, f"version_{self.version}")
+
+    @property
+    def metrics_file_path(self):
+        return os.path.join(self.log_dir, self.NAME_METRICS_FILE)
+
+    @property
+    def experiment(self):
+        return self
+
+    @rank_zero_only
+    def log_hyperparams(self, params, *args, **kwargs):
+        if not isinstance(params, dict):
+            params = vars(params)
+        self._buffer.append({"hparams": dict(params)})
+
+    @rank_zero_only
+    def log_metrics(self, metrics, step=None):
+        record = {k: float(v) for k, v in metrics.items()}
+        record["step"] = step
+        self._buffer.append(record)
+
+    @rank_zero_only
+    def save(self):
+        # called by the trainer after every log_metrics, so only write to
+        # disk once the flush interval has passed
+        if time.monotonic() - self._last_flush >= self.flush_secs:
+            self.flush()
+
+    @rank_zero_only
+    def finalize(self, status):
+        self.flush()
+
+    def flush(self):
+        self._last_flush = time.monotonic()
+        if not self._buffer:
+            return
+
+        os.makedirs(self.log_dir, exist_ok=True)
+        with open(self.metrics_file_path, "a") as f:
+            f.write(
+                "".join(json.dumps(r, default=str) + "\n" for r in self._buffer)
+            )
+        self._buffer = []
+
+    def _get_next_version(self):
+        existing_versions = []
+        for d in glob.glob(os.path.join(self.root_dir, "version_*")):
+            suffix = os.path.basename(d).split("_")[1]
+            if os.path.isdir(d) and suffix.isdigit():
+                existing_versions.append(int(suffix))
+
+        if len(existing_versions) == 0:
+            return 0
+
+        return max(existing_versions) + 1
+
+
+def load_metrics(*paths: str):
+    """Read and merge ``BufferedLogger`` metric files.
+
+    Each path can be a ``metrics.jsonl`` file or a directory that is searched
+    recursively (e.g. a signac job directory or the whole workspace). Returns a
+    list of metric records, each with the path of its source file under
+    ``"log_file"``. Hyperparameter records are merged into every metric record
+    of the same file.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            pattern = os.path.join(path, "**", BufferedLogger.NAME_METRICS_FILE)
+            files.extend(sorted(glob.glob(pattern, recursive=True)))
+        else:
+            files.append(path)
+
+    records = []
+    for file in files:
+        hparams = dict()
+        with open(file, "r") as f:
+            for line in f:
+                record = json.loads(line)
+                if "hparams" in record:
+                    hparams.update(record["hparams"])
+                else:
+                    records.append({**hparams, **record, "log_file": file})
+
+    return records
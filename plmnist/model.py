@@ -1,3 +1,5 @@
+import os
+import time
 import warnings
 
 import torch
@@ -10,16 +12,30 @@ from torchmetrics import Accuracy
 from torchvision import transforms
 from torchvision.datasets import MNIST
 
+from plmnist.shards import ShardedDataset, read_manifest
 from plmnist.config import (
     DATA_PATH,
     BATCH_SIZE,
     HIDDEN_SIZE,
     LEARNING_RATE,
     DROPOUT_PROB,
+    ADV_EPSILON,
+    ADV_RATIO,
+    SEED,
 )
 
 warnings.filterwarnings("ignore", message="The.*does not have many workers")
 
+# the images are normalized with this mean and std (see LitMNIST.transform), so
+# the valid pixel range [0, 1] maps to PIXEL_BOUNDS in the model's input space
+MNIST_MEAN, MNIST_STD = 0.1307, 0.3081
+PIXEL_BOUNDS = ((0 - MNIST_MEAN) / MNIST_STD, (1 - MNIST_MEAN) / MNIST_STD)
+
+
+def fgsm_attack(data, data_grad, epsilon, bounds=(0, 1)):
+    """Perturb a batch in the direction of the sign of its loss gradient."""
+    return torch.clamp(data + epsilon * data_grad.sign(), *bounds)
+
 
 # based on https://lightning.ai/docs/pytorch/stable/notebooks/lightning_examples/mnist-hello-world.html#
 class LitMNIST(pl.LightningModule):
@@ -30,6 +46,10 @@ class LitMNIST(pl.LightningModule):
         hidden_size=HIDDEN_SIZE,
         learning_rate=LEARNING_RATE,
         dropout_prob=DROPOUT_PROB,
+        shard_dir=None,
+        adv_epsilon=ADV_EPSILON,
+        adv_ratio=ADV_RATIO,
+        hidden_sizes=None,
     ):
         super().__init__()
 
@@ -39,43 +59,95 @@ class LitMNIST(pl.LightningModule):
         self.hidden_size = hidden_size
         self.learning_rate = learning_rate
         self.dropout_prob = dropout_prob
+        self.shard_dir = shard_dir
+        self.adv_epsilon = adv_epsilon
+        self.adv_ratio = adv_ratio
+
+        # per-layer widths, which differ after compaction (see plmnist.prune)
+        self.hidden_sizes = list(hidden_sizes or [hidden_size, hidden_size])
 
         self.save_hyperparameters()
 
         # Hardcode some dataset specific attributes
         self.num_classes = 10
         self.dims = (1, 28, 28)
+        if shard_dir is not None:
+            # sharded datasets (see plmnist.shards) store their own dims
+            manifest = read_manifest(shard_dir)
+            self.num_classes = manifest["num_classes"]
+            self.dims = tuple(manifest["dims"])
         channels, width, height = self.dims
         self.transform = transforms.Compose(
             [
                 transforms.ToTensor(),
-                transforms.Normalize((0.1307,), (0.3081,)),
+                transforms.Normalize((MNIST_MEAN,), (MNIST_STD,)),
             ]
         )
 
         # Define PyTorch model
         self.model = nn.Sequential(
             nn.Flatten(),
-            nn.Linear(channels * width * height, hidden_size),
+            nn.Linear(channels * width * height, self.hidden_sizes[0]),
             nn.ReLU(),
             nn.Dropout(dropout_prob),
-            nn.Linear(hidden_size, hidden_size),
+            nn.Linear(self.hidden_sizes[0], self.hidden_sizes[1]),
             nn.ReLU(),
             nn.Dropout(dropout_prob),
-            nn.Linear(hidden_size, self.num_classes),
+            nn.Linear(self.hidden_sizes[1], self.num_classes),
         )
 
-        self.val_accuracy = Accuracy(task="multiclass", num_classes=10)
-        self.test_accuracy = Accuracy(task="multiclass", num_classes=10)
+        self.val_accuracy = Accuracy(task="multiclass", num_classes=self.num_classes)
+
+        # clean test set evaluation, see plmnist.evaluate
+        self.clean_eval = None
 
     def forward(self, x):
         x = self.model(x)
         return F.log_softmax(x, dim=1)
 
+    def on_train_start(self):
+        # every rank is seeded identically so the data split and initial
+        # weights agree; offset the seed per rank so dropout masks differ
+        if self.trainer.world_size > 1 and "PL_GLOBAL_SEED" in os.environ:
+            torch.manual_seed(int(os.environ["PL_GLOBAL_SEED"]) + self.global_rank)
+
+    def on_train_epoch_start(self):
+        if isinstance(self.mnist_train, ShardedDataset):
+            self.mnist_train.set_epoch(self.current_epoch)
+
+    def on_train_batch_start(self, batch, batch_idx):
+        self._batch_start_time = time.perf_counter()
+
+    def on_train_batch_end(self, outputs, batch, batch_idx):
+        elapsed = time.perf_counter() - self._batch_start_time
+        self.log("train_samples_per_sec", len(batch[1]) / elapsed)
+
     def training_step(self, batch, batch_idx):
         x, y = batch
+
+        if self.adv_epsilon <= 0 or self.adv_ratio <= 0:
+            logits = self(x)
+            loss = F.nll_loss(logits, y)
+            self.log("train_loss", loss)
+            return loss
+
+        # adversarial training: the input gradient of the clean loss gives the
+        # FGSM perturbation for the whole batch, reusing the same forward graph
+        x = x.clone().requires_grad_(True)
         logits = self(x)
-        loss = F.nll_loss(logits, y)
+        clean_loss = F.nll_loss(logits, y)
+        (x_grad,) = torch.autograd.grad(clean_loss, x, retain_graph=True)
+
+        # keep the perturbed images within the normalized pixel range, so
+        # they differ from the clean images by at most adv_epsilon
+        x_adv = fgsm_attack(x.detach(), x_grad, self.adv_epsilon, PIXEL_BOUNDS)
+        adv_loss = F.nll_loss(self(x_adv), y)
+
+        loss = (1 - self.adv_ratio) * clean_loss + self.adv_ratio * adv_loss
+
+        self.log("train_clean_loss", clean_loss)
+        self.log("train_adv_loss", adv_loss)
+        self.log("train_loss", loss)
         return loss
 
     def validation_step(self, batch, batch_idx):
@@ -85,19 +157,11 @@ class LitMNIST(pl.LightningModule):
         preds = torch.argmax(logits, dim=1)
         self.val_accuracy.update(preds, y)
 
-        self.log("val_loss", loss, prog_bar=True)
+        # under DDP each rank sees part of the validation set, so the loss is
+        # averaged over the ranks (the accuracy metric syncs itself)
+        self.log("val_loss", loss, prog_bar=True, sync_dist=True)
         self.log("val_acc", self.val_accuracy, prog_bar=True)
 
-    def test_step(self, batch, batch_idx):
-        x, y = batch
-        logits = self(x)
-        loss = F.nll_loss(logits, y)
-        preds = torch.argmax(logits, dim=1)
-        self.test_accuracy.update(preds, y)
-
-        self.log("test_loss", loss, prog_bar=True)
-        self.log("test_acc", self.test_accuracy, prog_bar=True)
-
     def configure_optimizers(self):
         optimizer = torch.optim.Adam(self.parameters(), lr=self.learning_rate)
         return optimizer
@@ -107,11 +171,19 @@ class LitMNIST(pl.LightningModule):
     ####################
 
     def prepare_data(self):
+        if self.shard_dir is not None:
+            # sharded data is written ahead of time, see plmnist.shards
+            return
+
         # download
         MNIST(self.data_dir, train=True, download=True)
         MNIST(self.data_dir, train=False, download=True)
 
     def setup(self, stage=None):
+        if self.shard_dir is not None:
+            self._setup_shards(stage)
+            return
+
         # Assign train/val datasets for use in dataloaders
         if stage == "fit" or stage is None:
             mnist_full = MNIST(self.data_dir, train=True, transform=self.transform)
@@ -123,6 +195,19 @@ class LitMNIST(pl.LightningModule):
                 self.data_dir, train=False, transform=self.transform
             )
 
+    def _setup_shards(self, stage=None):
+        # every rank shuffles the shards with the same seed
+        seed = int(os.environ.get("PL_GLOBAL_SEED", SEED))
+
+        if stage == "fit" or stage is None:
+            self.mnist_train = ShardedDataset(
+                self.shard_dir, "train", self.transform, shuffle=True, seed=seed
+            )
+            self.mnist_val = ShardedDataset(self.shard_dir, "val", self.transform)
+
+        if stage == "test" or stage is None:
+            self.mnist_test = ShardedDataset(self.shard_dir, "test", self.transform)
+
     def train_dataloader(self):
         return DataLoader(self.mnist_train, batch_size=self.batch_size)
 
@@ -1,9 +1,20 @@
 import os, json, hashlib
 
+import torch
 import pytorch_lightning as pl
-from pytorch_lightning.loggers import CSVLogger
+from pytorch_lightning.strategies import DDPStrategy
+from pytorch_lightning.plugins.environments import LightningEnvironment
 
 from plmnist.model import LitMNIST
+from plmnist.logger import BufferedLogger
+from plmnist.export import export_with_parity
+from plmnist.status import record, results_scalars
+from plmnist.evaluate import (
+    evaluate_clean,
+    save_clean_eval,
+    clean_eval_path,
+    dataset_version,
+)
 from plmnist.config import (
     DATA_PATH,
     LOG_PATH,
@@ -13,6 +24,12 @@ from plmnist.config import (
     HIDDEN_SIZE,
     LEARNING_RATE,
     DROPOUT_PROB,
+    ADV_EPSILON,
+    ADV_RATIO,
+    ACCELERATOR,
+    DEVICES,
+    STRATEGY,
+    LOG_EVERY_N_STEPS,
 )
 
 
@@ -24,6 +41,12 @@ def train(
     hidden_size: int = HIDDEN_SIZE,
     learning_rate: float = LEARNING_RATE,
     dropout_prob: float = DROPOUT_PROB,
+    adv_epsilon: float = ADV_EPSILON,
+    adv_ratio: float = ADV_RATIO,
+    accelerator: str = ACCELERATOR,
+    devices: int = DEVICES,
+    strategy: str = STRATEGY,
+    shard_dir: str = None,
 ):
     model = LitMNIST(
         data_dir=data_dir,
@@ -31,38 +54,80 @@ def train(
         hidden_size=hidden_size,
         learning_rate=learning_rate,
         dropout_prob=dropout_prob,
+        shard_dir=shard_dir,
+        adv_epsilon=adv_epsilon,
+        adv_ratio=adv_ratio,
     )
 
+    # multi-process data-parallel training on CPU uses the gloo backend, with
+    # the ranks launched locally by Lightning (also inside a SLURM allocation)
+    if strategy == "ddp" and accelerator == "cpu":
+        strategy = DDPStrategy(
+            cluster_environment=LightningEnvironment(),
+            process_group_backend="gloo",
+        )
+
     trainer = pl.Trainer(
-        accelerator="auto",
+        accelerator=accelerator,
+        devices=devices,
+        strategy=strategy,
         max_epochs=max_epochs,
-        logger=CSVLogger(save_dir=log_path),
+        log_every_n_steps=LOG_EVERY_N_STEPS,
+        logger=BufferedLogger(save_dir=log_path),
     )
     trainer.fit(model)
 
+    # test() and write() only run on rank 0 after a multi-process fit,
+    # so the other ranks are released here instead of waiting at a barrier
+    if trainer.world_size > 1 and torch.distributed.is_initialized():
+        torch.distributed.destroy_process_group()
+
     return trainer, model
 
 
 def test(trainer: pl.Trainer, seed=None):
+    model = trainer.lightning_module
+
     results = dict()
     results["config"] = dict()
-    results["config"]["batch_size"] = trainer.model.batch_size
-    results["config"]["hidden_size"] = trainer.model.hidden_size
-    results["config"]["learning_rate"] = trainer.model.learning_rate
-    results["config"]["dropout_prob"] = trainer.model.dropout_prob
+    results["config"]["batch_size"] = model.batch_size
+    results["config"]["hidden_size"] = model.hidden_size
+    results["config"]["learning_rate"] = model.learning_rate
+    results["config"]["dropout_prob"] = model.dropout_prob
     results["config"]["max_epochs"] = trainer.max_epochs
     results["config"]["log_dir"] = trainer.logger.log_dir
 
     if seed is not None:
         results["config"]["seed"] = seed
 
+    if model.adv_epsilon > 0:
+        results["config"]["adv_epsilon"] = model.adv_epsilon
+        results["config"]["adv_ratio"] = model.adv_ratio
+
+    if model.shard_dir is not None:
+        results["config"]["shard_dir"] = model.shard_dir
+
     results["val_loss"] = trainer.callback_metrics["val_loss"].item()
     results["val_acc"] = trainer.callback_metrics["val_acc"].item()
 
-    trainer.test(ckpt_path="best")
+    # evaluate the best weights in memory instead of reloading the
+    # checkpoint and rebuilding the test loop with trainer.test()
+    ckpt_callback = trainer.checkpoint_callback
+    if ckpt_callback is not None and ckpt_callback.monitor is not None:
+        # without a monitor the best checkpoint is the final weights
+        best_ckpt = torch.load(ckpt_callback.best_model_path, map_location="cpu")
+        model.load_state_dict(best_ckpt["state_dict"])
+
+    model.setup("test")
+    model.clean_eval = evaluate_clean(model)
 
-    results["test_loss"] = trainer.callback_metrics["test_loss"].item()
-    results["test_acc"] = trainer.callback_metrics["test_acc"].item()
+    results["test_loss"] = model.clean_eval["loss"]
+    results["test_acc"] = model.clean_eval["acc"]
+
+    trainer.logger.log_metrics(
+        {"test_loss": results["test_loss"], "test_acc": results["test_acc"]}
+    )
+    trainer.logger.finalize("success")
 
     return results
 
@@ -72,6 +137,7 @@ def write(
     trainer: pl.Trainer,
     directory: str = RESULT_PATH,
     do_dhash: bool = True,
+    export_format: str = None,
 ):
     if do_dhash:
         results["hash"] = hashlib.md5(
@@ -83,9 +149,32 @@ def write(
         dhash = ""
 
     os.makedirs(directory, exist_ok=True)
-    with open(f"{directory}/results{dhash}.json", "w") as f:
+
+    results_path = f"{directory}/results{dhash}.json"
+    with open(results_path, "w") as f:
         json.dump(results, f)
 
-    trainer.save_checkpoint(f"{directory}/model{dhash}.ckpt")
+    ckpt_path = f"{directory}/model{dhash}.ckpt"
+    trainer.save_checkpoint(ckpt_path)
+
+    model = trainer.lightning_module
+    if model.clean_eval is not None:
+        save_clean_eval(
+            model.clean_eval,
+            ckpt_path,
+            clean_eval_path(directory, dhash),
+            dataset_version(model.mnist_test),
+        )
+
+    record(directory, "train", results_path, results_scalars(results))
+
+    if export_format is not None:
+        # frozen inference copy, loadable with plmnist.inference; exported
+        # last, so a failed export does not lose the training results
+        results["export"] = export_with_parity(model, directory, dhash, export_format)
+        with open(results_path, "w") as f:
+            json.dump(results, f)
+
+        record(directory, "export", results_path, results_scalars(results))
 
     return dhash
@@ -0,0 +1,212 @@
+import os, json, argparse
+
+import torch
+import pytorch_lightning as pl
+from torch import nn
+from torch.nn import functional as F
+
+from plmnist.model import LitMNIST
+from plmnist.evaluate import evaluate_clean
+from plmnist.export import batch_latency
+from plmnist.status import record, results_scalars
+from plmnist.config import (
+    RESULT_PATH,
+    SEED,
+    BATCH_SIZE,
+    PRUNE_THRESHOLD,
+    FINETUNE_STEPS,
+)
+
+
+@torch.no_grad()
+def hidden_unit_scores(model: LitMNIST):
+    """Score every hidden unit by its contribution on the validation split.
+
+    The score of a unit is its mean activation (after ReLU) times the L2 norm
+    of its outgoing weights, so dead units score exactly 0.
+    """
+    relus = [m for m in model.model if isinstance(m, nn.ReLU)]
+    linears = [m for m in model.model if isinstance(m, nn.Linear)]
+
+    sums = [torch.zeros(linear.out_features) for linear in linears[:-1]]
+    count = 0
+
+    def hook(i):
+        def accumulate(module, inputs, output):
+            sums[i] += output.sum(dim=0).cpu()
+
+        return accumulate
+
+    handles = [relu.register_forward_hook(hook(i)) for i, relu in enumerate(relus)]
+
+    was_training = model.training
+    model.eval()
+    for data, _ in model.val_dataloader():
+        model(data.to(model.device))
+        count += len(data)
+    model.train(was_training)
+
+    for handle in handles:
+        handle.remove()
+
+    return [
+        (s / count) * linears[i + 1].weight.norm(dim=0).cpu()
+        for i, s in enumerate(sums)
+    ]
+
+
+@torch.no_grad()
+def compact(model: LitMNIST, threshold: float = PRUNE_THRESHOLD):
+    """Return a copy of the model without its low-scoring hidden units.
+
+    Units scoring at most ``threshold`` times the top score of their layer are
+    removed (at least one unit per layer is kept), giving smaller
+    ``nn.Linear`` layers. With ``threshold=0`` only the units that never fire
+    on the validation split are removed, which keeps the validation outputs.
+    """
+    scores = hidden_unit_scores(model)
+    keep = []
+    for layer_scores in scores:
+        kept = torch.nonzero(layer_scores > threshold * layer_scores.max()).flatten()
+        if len(kept) == 0:
+            kept = torch.argmax(layer_scores).unsqueeze(0)
+        keep.append(kept)
+
+    compacted = LitMNIST(**{**model.hparams, "hidden_sizes": [len(k) for k in keep]})
+
+    linears = [m for m in model.model if isinstance(m, nn.Linear)]
+    new_linears = [m for m in compacted.model if isinstance(m, nn.Linear)]
+    for i, (linear, new_linear) in enumerate(zip(linears, new_linears)):
+        weight, bias = linear.weight, linear.bias
+        if i > 0:
+            weight = weight[:, keep[i - 1]]
+        if i < len(keep):
+            weight, bias = weight[keep[i]], bias[keep[i]]
+
+        new_linear.weight.copy_(weight)
+        new_linear.bias.copy_(bias)
+
+    return compacted
+
+
+def finetune(model: LitMNIST, train_dataloader, steps: int = FINETUNE_STEPS):
+    """Train the model for a few steps, with the clean loss only."""
+    optimizer = model.configure_optimizers()
+    model.train()
+
+    step = 0
+    while step < steps:
+        for data, target in train_dataloader:
+            loss = F.nll_loss(model(data), target)
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+
+            step += 1
+            if step >= steps:
+                break
+
+    model.eval()
+    return model
+
+
+def _summary(model: LitMNIST, batch_size: int = BATCH_SIZE):
+    model.setup("test")
+    x = torch.randn(batch_size, *model.dims)
+    return {
+        "hidden_sizes": model.hidden_sizes,
+        "num_params": sum(p.numel() for p in model.parameters()),
+        "test_acc": evaluate_clean(model)["acc"],
+        "batch_latency_sec": batch_latency(model.eval(), x, num_batches=100),
+    }
+
+
+def save_compacted(model: LitMNIST, ckpt_path: str):
+    # the same keys as a Lightning checkpoint, so LitMNIST.load_from_checkpoint works
+    torch.save(
+        {
+            "state_dict": model.state_dict(),
+            "hyper_parameters": dict(model.hparams),
+            "pytorch-lightning_version": pl.__version__,
+        },
+        ckpt_path,
+    )
+
+
+def add_compaction_to_results(compaction: dict, results_path: str):
+    if os.path.exists(results_path):
+        with open(results_path, "r") as f:
+            results = json.load(f)
+
+        results["compaction"] = compaction
+
+        with open(results_path, "w") as f:
+            json.dump(results, f)
+
+        record(os.path.dirname(results_path), "compaction", results_path, results_scalars(results))
+    else:
+        raise FileNotFoundError(f"File not found: {results_path}")
+
+
+def compact_from_path(
+    result_path: str,
+    dhash: str = "",
+    threshold: float = PRUNE_THRESHOLD,
+    finetune_steps: int = FINETUNE_STEPS,
+    seed: int = None,
+):
+    ckpt_path = f"{result_path}/model{dhash}.ckpt"
+    compact_ckpt_path = f"{result_path}/model{dhash}-compact.ckpt"
+    json_path = f"{result_path}/results{dhash}.json"
+
+    # the same seed as training gives the same train/val split, so the units
+    # are scored on images the model was not trained on
+    if seed is None:
+        with open(json_path, "r") as f:
+            seed = json.load(f)["config"].get("seed", SEED)
+    pl.seed_everything(seed)
+
+    model = LitMNIST.load_from_checkpoint(ckpt_path, map_location="cpu")
+    model.setup()
+
+    compacted = compact(model, threshold)
+    if finetune_steps > 0:
+        # reuse the training split of the original model
+        compacted = finetune(compacted, model.train_dataloader(), finetune_steps)
+
+    compaction = {
+        "threshold": threshold,
+        "finetune_steps": finetune_steps,
+        "path": compact_ckpt_path,
+        "before": _summary(model),
+        "after": _summary(compacted),
+    }
+
+    save_compacted(compacted, compact_ckpt_path)
+    add_compaction_to_results(compaction, json_path)
+
+    print(
+        "Hidden sizes: {} -> {}\tTest accuracy: {} -> {}".format(
+            compaction["before"]["hidden_sizes"],
+            compaction["after"]["hidden_sizes"],
+            compaction["before"]["test_acc"],
+            compaction["after"]["test_acc"],
+        )
+    )
+
+    return compaction
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    # defaults to the training seed from the results json
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--result_path", type=str, default=RESULT_PATH)
+    parser.add_argument("--dhash", type=str, default="")
+    parser.add_argument("--threshold", type=float, default=PRUNE_THRESHOLD)
+    parser.add_argument("--finetune_steps", type=int, default=FINETUNE_STEPS)
+    args = parser.parse_args()
+
+    compact_from_path(
+        args.result_path, args.dhash, args.threshold, args.finetune_steps, args.seed
+    )
@@ -0,0 +1,284 @@
+import os, json, hashlib, argparse
+
+import numpy as np
+import torch
+from torch.utils.data import IterableDataset, get_worker_info
+from torchvision.datasets import MNIST
+
+from plmnist.config import DATA_PATH, SHARD_PATH, SHARD_SIZE, SHUFFLE_BUFFER_SIZE, SEED
+
+
+MANIFEST_FILE = "manifest.json"
+
+
+# ┌───────────────────────────────┐
+# │ Writing the sharded format    │
+# └───────────────────────────────┘
+
+
+def write_shards(
+    chunks, out_dir: str, shard_size: int = SHARD_SIZE, num_classes: int = 10
+):
+    """Write (images, labels) chunks as fixed-size on-disk shards.
+
+    ``chunks`` is any iterable of ``(images, labels)`` numpy arrays, with uint8
+    images of shape (n, height, width). Only one shard is held in memory at a
+    time. Each shard is an ``images_NNNNN.npy``/``labels_NNNNN.npy`` pair, and
+    the ``manifest.json`` file lists the shard sizes and the image dims.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+
+    shard_sizes, dims = [], None
+    images_buf, labels_buf, buffered = [], [], 0
+
+    def flush():
+        images = np.concatenate(images_buf)
+        labels = np.concatenate(labels_buf)
+        i = len(shard_sizes)
+        np.save(os.path.join(out_dir, f"images_{i:05d}.npy"), images)
+        np.save(os.path.join(out_dir, f"labels_{i:05d}.npy"), labels.astype(np.int64))
+        shard_sizes.append(len(labels))
+
+    for images, labels in chunks:
+        dims = (1, *images.shape[1:])
+        while len(labels):
+            take = shard_size - buffered
+            images_buf.append(images[:take])
+            labels_buf.append(labels[:take])
+            buffered += len(labels[:take])
+            images, labels = images[take:], labels[take:]
+
+            if buffered == shard_size:
+                flush()
+                images_buf, labels_buf, buffered = [], [], 0
+
+    if buffered:
+        flush()
+
+    manifest = {
+        "shard_sizes": shard_sizes,
+        "dims": dims,
+        "num_classes": num_classes,
+    }
+    with open(os.path.join(out_dir, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f)
+
+    return manifest
+
+
+def write_split(out_dir: str, name: str, indices):
+    """Store a split as a sorted index file of global sample indices."""
+    os.makedirs(os.path.join(out_dir, "splits"), exist_ok=True)
+    np.save(
+        os.path.join(out_dir, "splits", f"{name}.npy"),
+        np.sort(np.asarray(indices, dtype=np.int64)),
+    )
+
+
+def read_manifest(shard_dir: str):
+    with open(os.path.join(shard_dir, MANIFEST_FILE), "r") as f:
+        return json.load(f)
+
+
+def mnist_to_shards(
+    data_dir: str = DATA_PATH,
+    out_dir: str = SHARD_PATH,
+    shard_size: int = SHARD_SIZE,
+    val_size: int = 5000,
+    seed: int = SEED,
+):
+    """Convert the downloaded MNIST data to the sharded format.
+
+    The train images come first, followed by the test images, with the
+    ``train``/``val``/``test`` splits written as index files.
+    """
+    mnist_train = MNIST(data_dir, train=True)
+    mnist_test = MNIST(data_dir, train=False)
+
+    chunks = (
+        (ds.data[i : i + shard_size].numpy(), ds.targets[i : i + shard_size].numpy())
+        for ds in (mnist_train, mnist_test)
+        for i in range(0, len(ds), shard_size)
+    )
+    manifest = write_shards(chunks, out_dir, shard_size, num_classes=10)
+
+    num_train = len(mnist_train)
+    perm = np.random.default_rng(seed).permutation(num_train)
+    write_split(out_dir, "train", perm[val_size:])
+    write_split(out_dir, "val", perm[:val_size])
+    write_split(out_dir, "test", np.arange(num_train, num_train + len(mnist_test)))
+
+    return manifest
+
+
+# ┌───────────────────────────────┐
+# │ Streaming the sharded format  │
+# └───────────────────────────────┘
+
+
+class ShardedDataset(IterableDataset):
+    """Stream one split of a sharded dataset without loading it into memory.
+
+    The samples of the split are read shard by shard (memory-mapped one at a
+    time), and split evenly into contiguous ranges for each (rank, dataloader
+    worker) pair, so a range can start or end inside a shard. With
+    ``shuffle=True`` the shard order is reshuffled every epoch (see
+    ``set_epoch``), and samples are shuffled through a buffer of at most
+    ``buffer_size`` samples. Memory use only depends on the shard and buffer
+    sizes, not on the dataset size.
+
+    For multi-process training every rank yields the same number of samples
+    per epoch, so fewer than ``world_size`` samples are skipped each epoch.
+    """
+
+    def __init__(
+        self,
+        shard_dir: str,
+        split: str,
+        transform=None,
+        shuffle: bool = False,
+        buffer_size: int = SHUFFLE_BUFFER_SIZE,
+        seed: int = SEED,
+    ):
+        super().__init__()
+        self.shard_dir = shard_dir
+        self.split = split
+        self.transform = transform
+        self.shuffle = shuffle
+        self.buffer_size = buffer_size
+        self.seed = seed
+        self.epoch = 0
+
+        manifest = read_manifest(shard_dir)
+        self.shard_sizes = manifest["shard_sizes"]
+        self.shard_offsets = np.cumsum([0] + self.shard_sizes)
+        self.split_path = os.path.join(shard_dir, "splits", f"{split}.npy")
+
+        # position of each shard's first sample in the split index, and the
+        # number of samples of the split in each shard
+        split_index = np.load(self.split_path, mmap_mode="r")
+        split_positions = np.searchsorted(split_index, self.shard_offsets)
+        self.split_starts = split_positions[:-1]
+        self.split_counts = np.diff(split_positions)
+
+        # set up is called after the process group is initialized, and the
+        # dataloader workers inherit these values
+        if torch.distributed.is_available() and torch.distributed.is_initialized():
+            self.rank = torch.distributed.get_rank()
+            self.world_size = torch.distributed.get_world_size()
+        else:
+            self.rank, self.world_size = 0, 1
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def fingerprint(self):
+        """Hash of the manifest and split index file, used as the dataset version."""
+        md5 = hashlib.md5()
+        with open(os.path.join(self.shard_dir, MANIFEST_FILE), "rb") as f:
+            md5.update(f.read())
+        md5.update(np.load(self.split_path, mmap_mode="r").tobytes())
+        return md5.hexdigest()
+
+    def _assigned_ranges(self):
+        """Return the (shard, start, stop) ranges of split samples to read."""
+        worker_info = get_worker_info()
+        worker_id = worker_info.id if worker_info is not None else 0
+        num_workers = worker_info.num_workers if worker_info is not None else 1
+
+        # the shards with samples of this split, in the order they are read
+        shards = np.flatnonzero(self.split_counts)
+        if self.shuffle:
+            shards = np.random.default_rng(self.seed + self.epoch).permutation(shards)
+        stops = np.cumsum(self.split_counts[shards])
+        starts = stops - self.split_counts[shards]
+        total = int(stops[-1]) if len(stops) else 0
+
+        # every rank needs samples, as the metrics are synced across ranks
+        if total < self.world_size:
+            raise ValueError(
+                f"The '{self.split}' split has {total} samples, fewer than "
+                f"the {self.world_size} ranks."
+            )
+
+        if self.shuffle:
+            # the gradients of every training batch are all-reduced across
+            # ranks, so every rank must yield the same number of batches
+            rank_sizes = [total // self.world_size] * self.world_size
+        else:
+            rank_sizes = _even_sizes(total, self.world_size)
+
+        # the same sizes per worker on every rank, so the same number of batches
+        worker_sizes = _even_sizes(rank_sizes[self.rank], num_workers)
+        lo = sum(rank_sizes[: self.rank]) + sum(worker_sizes[:worker_id])
+        hi = lo + worker_sizes[worker_id]
+
+        return [
+            (shard, max(lo, start) - start, min(hi, stop) - start)
+            for shard, start, stop in zip(shards, starts, stops)
+            if max(lo, start) < min(hi, stop)
+        ]
+
+    def _iter_samples(self, ranges):
+        split = np.load(self.split_path, mmap_mode="r")
+        for shard, start, stop in ranges:
+            first = self.split_starts[shard]
+            local = np.asarray(split[first + start : first + stop]) - self.shard_offsets[shard]
+            images = np.load(
+                os.path.join(self.shard_dir, f"images_{shard:05d}.npy"), mmap_mode="r"
+            )
+            labels = np.load(
+                os.path.join(self.shard_dir, f"labels_{shard:05d}.npy"), mmap_mode="r"
+            )
+            for i in local:
+                yield np.array(images[i]), int(labels[i])
+
+    def __iter__(self):
+        samples = self._iter_samples(self._assigned_ranges())
+
+        if self.shuffle:
+            worker_info = get_worker_info()
+            worker_id = worker_info.id if worker_info is not None else 0
+            rng = np.random.default_rng(
+                (self.seed, self.epoch, self.rank, worker_id)
+            )
+            samples = _shuffle_buffer(samples, self.buffer_size, rng)
+
+        for image, label in samples:
+            if self.transform is not None:
+                image = self.transform(image)
+            yield image, label
+
+
+def _even_sizes(total: int, parts: int):
+    # sizes of ``parts`` contiguous ranges covering ``total`` items, differing by at most 1
+    return [total // parts + (i < total % parts) for i in range(parts)]
+
+
+def _shuffle_buffer(samples, buffer_size: int, rng):
+    buffer = []
+    for sample in samples:
+        if len(buffer) < buffer_size:
+            buffer.append(sample)
+            continue
+
+        i = rng.integers(buffer_size)
+        yield buffer[i]
+        buffer[i] = sample
+
+    rng.shuffle(buffer)
+    yield from buffer
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data_dir", type=str, default=DATA_PATH)
+    parser.add_argument("--shard_dir", type=str, default=SHARD_PATH)
+    parser.add_argument("--shard_size", type=int, default=SHARD_SIZE)
+    parser.add_argument("--val_size", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=SEED)
+    args = parser.parse_args()
+
+    mnist_to_shards(
+        args.data_dir, args.shard_dir, args.shard_size, args.val_size, args.seed
+    )
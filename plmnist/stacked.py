@@ -0,0 +1,224 @@
+import os, json, argparse
+
+import torch
+import pytorch_lightning as pl
+import torch.nn.functional as F
+
+from plmnist.model import LitMNIST, fgsm_attack
+from plmnist.status import record, results_scalars
+from plmnist.config import FGSM_EPSILON, BATCH_SIZE, SEED
+
+
+# ┌────────────────────────────────────┐
+# │ Stacked weights of several models  │
+# └────────────────────────────────────┘
+
+
+class StackedMLP:
+    """The ``LitMNIST.model`` layers of M models, evaluated together.
+
+    The weights of each ``nn.Linear`` layer are stacked along a new model
+    dimension, so a batch of shape (M, B, ...) runs through all the models
+    with one batched matmul per layer (in eval mode, i.e. without dropout).
+    """
+
+    def __init__(self, state_dicts: list):
+        names = [
+            k[: -len(".weight")]
+            for k in state_dicts[0]
+            if k.startswith("model.") and k.endswith(".weight")
+        ]
+        names.sort(key=lambda k: int(k.split(".")[1]))
+
+        self.weights = [
+            torch.stack([sd[f"{n}.weight"] for sd in state_dicts]).transpose(1, 2)
+            for n in names
+        ]
+        self.biases = [
+            torch.stack([sd[f"{n}.bias"] for sd in state_dicts]).unsqueeze(1)
+            for n in names
+        ]
+
+    def __call__(self, x):
+        h = x.flatten(2)
+        for i, (weight, bias) in enumerate(zip(self.weights, self.biases)):
+            h = torch.baddbmm(bias, h, weight)
+            if i < len(self.weights) - 1:
+                h = F.relu(h)
+        return F.log_softmax(h, dim=2)
+
+
+def _load(ckpt_path: str):
+    # memory-mapped, so the optimizer and loop state of the Lightning
+    # checkpoint are never read; only the weights and hyperparameters are kept
+    checkpoint = torch.load(ckpt_path, map_location="cpu", mmap=True)
+    return {
+        "state_dict": checkpoint["state_dict"],
+        "hyper_parameters": checkpoint["hyper_parameters"],
+    }
+
+
+def _architecture(hparams: dict):
+    # models can be stacked if their layers have the same sizes (see LitMNIST)
+    # and they are evaluated on the same data
+    hidden_sizes = hparams.get("hidden_sizes") or [hparams["hidden_size"]] * 2
+    return tuple(hidden_sizes), hparams.get("data_dir"), hparams.get("shard_dir")
+
+
+# ┌────────────────────────────────────┐
+# │ Clean + FGSM evaluation            │
+# └────────────────────────────────────┘
+
+
+def stacked_evaluate(
+    checkpoints: list, epsilons: list, batch_size: int = BATCH_SIZE, names: list = None
+):
+    """Clean and FGSM evaluation of models with the same architecture.
+
+    All models see each test batch once. The FGSM attack matches ``fgsm()``:
+    only correctly classified images are attacked, with the sign of the
+    per-image loss gradient, and the first 5 adversarial examples are kept.
+    Returns one dict per model with ``test_loss``, ``test_acc`` and the
+    ``fgsm`` tuple.
+    """
+    net = StackedMLP([c["state_dict"] for c in checkpoints])
+    eps = torch.tensor(epsilons, dtype=torch.float32).view(-1, 1, 1)
+    num_models = len(checkpoints)
+    names = names or list(range(num_models))
+
+    # the test data of the first model, which all the models share
+    data_model = LitMNIST(**{**checkpoints[0]["hyper_parameters"], "batch_size": batch_size})
+    data_model.setup("test")
+    image_shape = data_model.dims[1:]
+
+    loss_sum = torch.zeros(num_models)
+    clean_correct = torch.zeros(num_models, dtype=torch.long)
+    fgsm_correct = torch.zeros(num_models, dtype=torch.long)
+    count = 0
+    examples = [[] for _ in range(num_models)]
+
+    for data, target in data_model.test_dataloader():
+        x = data.flatten(1).expand(num_models, -1, -1).clone().requires_grad_(True)
+        y = target.expand(num_models, -1)
+
+        logits = net(x)
+        init_pred = torch.argmax(logits, dim=2)
+        was_correct = init_pred == y
+
+        # the models are independent, so the gradient of the summed loss is
+        # the per-model, per-image gradient
+        loss = F.nll_loss(logits.transpose(1, 2), y, reduction="none")
+        (x_grad,) = torch.autograd.grad(loss.sum(), x)
+
+        with torch.no_grad():
+            perturbed = fgsm_attack(x.detach(), x_grad, eps)
+            final_pred = torch.argmax(net(perturbed), dim=2)
+
+        loss_sum += loss.detach().sum(dim=1)
+        clean_correct += was_correct.sum(dim=1)
+        fgsm_correct += (was_correct & (final_pred == y)).sum(dim=1)
+        count += len(target)
+
+        fooled = was_correct & (final_pred != y)
+        for m in range(num_models):
+            for i in torch.nonzero(fooled[m]).flatten()[: 5 - len(examples[m])]:
+                # save only first 5
+                examples[m].append(
+                    (
+                        init_pred[m, i].item(),
+                        final_pred[m, i].item(),
+                        perturbed[m, i].view(image_shape).squeeze().numpy().tolist(),
+                        data[i].squeeze().numpy().tolist(),
+                    )
+                )
+
+    metrics = []
+    for m in range(num_models):
+        fgsm_acc = fgsm_correct[m].item() / clean_correct[m].item()
+        metrics.append(
+            {
+                "test_loss": loss_sum[m].item() / count,
+                "test_acc": clean_correct[m].item() / count,
+                "fgsm": (fgsm_acc, examples[m], epsilons[m]),
+            }
+        )
+        print(
+            "{}\tTest Accuracy = {}\tEpsilon: {}\tFGSM Accuracy = {}".format(
+                names[m], metrics[m]["test_acc"], epsilons[m], fgsm_acc
+            )
+        )
+
+    return metrics
+
+
+def results_path_for(ckpt_path: str):
+    # model{dhash}.ckpt -> results{dhash}.json
+    directory, name = os.path.split(ckpt_path)
+    return os.path.join(directory, "results" + name[len("model") : -len(".ckpt")] + ".json")
+
+
+def add_stacked_to_results(metrics: dict, results_path: str):
+    if os.path.exists(results_path):
+        with open(results_path, "r") as f:
+            results = json.load(f)
+
+        results["test_loss"] = metrics["test_loss"]
+        results["test_acc"] = metrics["test_acc"]
+
+        results["fgsm"] = dict()
+        results["fgsm"]["accuracy"] = metrics["fgsm"][0]
+        results["fgsm"]["examples"] = metrics["fgsm"][1]
+        results["fgsm"]["epsilon"] = metrics["fgsm"][2]
+
+        with open(results_path, "w") as f:
+            json.dump(results, f)
+
+        record(os.path.dirname(results_path), "fgsm", results_path, results_scalars(results))
+    else:
+        raise FileNotFoundError(f"File not found: {results_path}")
+
+
+def stacked_evaluate_and_write(
+    ckpt_paths: list, epsilons: list, batch_size: int = BATCH_SIZE, max_models: int = 64
+):
+    """Group the models by architecture, evaluate each group in one pass, and
+    write the metrics to each model's results json file."""
+    # group by the hyperparameters only, so at most max_models checkpoints
+    # are loaded at a time below
+    groups = dict()
+    for ckpt_path, epsilon in zip(ckpt_paths, epsilons):
+        hparams = _load(ckpt_path)["hyper_parameters"]
+        groups.setdefault(_architecture(hparams), []).append((ckpt_path, epsilon))
+
+    for group in groups.values():
+        # bound the memory use of very large groups
+        for i in range(0, len(group), max_models):
+            paths, group_epsilons = zip(*group[i : i + max_models])
+            checkpoints = [_load(ckpt_path) for ckpt_path in paths]
+            metrics = stacked_evaluate(
+                checkpoints, list(group_epsilons), batch_size, list(paths)
+            )
+
+            for ckpt_path, model_metrics in zip(paths, metrics):
+                add_stacked_to_results(model_metrics, results_path_for(ckpt_path))
+
+            del checkpoints, metrics
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("ckpt_paths", nargs="+")
+    parser.add_argument("--fgsm_epsilon", type=float, nargs="+", default=[FGSM_EPSILON])
+    parser.add_argument("--batch_size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--max_models", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=SEED)
+    args = parser.parse_args()
+
+    # one epsilon for all the models, or one per model
+    epsilons = args.fgsm_epsilon
+    if len(epsilons) == 1:
+        epsilons = epsilons * len(args.ckpt_paths)
+
+    pl.seed_everything(args.seed)
+
+    stacked_evaluate_and_write(args.ckpt_paths, epsilons, args.batch_size, args.max_models)
@@ -0,0 +1,229 @@
+import os, json, time, sqlite3, hashlib, argparse
+
+from plmnist.config import STATUS_INDEX
+
+
+# results keys stored in the index, so status and analysis queries do not
+# need to parse the results json files
+SCALAR_KEYS = ("val_loss", "val_acc", "test_loss", "test_acc")
+
+# stages computed from the trained model, which are out of date once the
+# model is (re)trained in the same directory
+TRAIN_DEPENDENT_STAGES = ("fgsm", "pgd", "compaction")
+
+
+def _connect(index_path: str):
+    conn = sqlite3.connect(index_path, timeout=60)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS status ("
+        "directory TEXT NOT NULL, "
+        "stage TEXT NOT NULL, "
+        "checksum TEXT, "
+        "scalars TEXT, "
+        "updated REAL, "
+        "size INTEGER, "
+        "mtime_ns INTEGER, "
+        "PRIMARY KEY (directory, stage))"
+    )
+
+    # indexes written before the results file stat was stored
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(status)")]
+    for column in ("size", "mtime_ns"):
+        if column not in columns:
+            conn.execute(f"ALTER TABLE status ADD COLUMN {column} INTEGER")
+
+    return conn
+
+
+def results_scalars(results: dict):
+    scalars = {key: results[key] for key in SCALAR_KEYS if key in results}
+    if "fgsm" in results and "accuracy" in results["fgsm"]:
+        scalars["fgsm_acc"] = results["fgsm"]["accuracy"]
+    return scalars
+
+
+def file_checksum(path: str):
+    with open(path, "rb") as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+
+def _file_stat(path: str):
+    # a cheap staleness check, without reading the file
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def record(
+    directory: str,
+    stage: str,
+    results_path: str = None,
+    scalars: dict = None,
+    index_path: str = STATUS_INDEX,
+):
+    """Mark a stage as finished for a result directory, in one transaction.
+
+    The results file was rewritten by the stage, so its checksum (kept for
+    auditing) and stat are updated for the other stages of the directory too
+    (their results are kept in the file), and recording ``"train"`` forgets
+    the ``TRAIN_DEPENDENT_STAGES``.
+    Does nothing if no index is set (``PLM_STATUS_INDEX``).
+    """
+    if not index_path:
+        return
+
+    directory = os.path.abspath(directory)
+    checksum, size, mtime_ns = None, None, None
+    if results_path:
+        checksum = file_checksum(results_path)
+        size, mtime_ns = _file_stat(results_path)
+
+    conn = _connect(index_path)
+    try:
+        with conn:
+            if stage == "train":
+                _forget(conn, directory, TRAIN_DEPENDENT_STAGES)
+            if checksum is not None:
+                conn.execute(
+                    "UPDATE status SET checksum = ?, size = ?, mtime_ns = ? "
+                    "WHERE directory = ? AND checksum IS NOT NULL",
+                    (checksum, size, mtime_ns, directory),
+                )
+            conn.execute(
+                "INSERT OR REPLACE INTO status "
+                "(directory, stage, checksum, scalars, updated, size, mtime_ns) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    directory,
+                    stage,
+                    checksum,
+                    json.dumps(scalars or dict()),
+                    time.time(),
+                    size,
+                    mtime_ns,
+                ),
+            )
+    finally:
+        conn.close()
+
+
+def _forget(conn, directory: str, stages):
+    conn.executemany(
+        "DELETE FROM status WHERE directory = ? AND stage = ?",
+        [(directory, stage) for stage in stages],
+    )
+
+
+def forget(directory: str, stages, index_path: str = STATUS_INDEX):
+    """Forget some stages of one directory (e.g., before they are rerun)."""
+    if not index_path or not os.path.exists(index_path):
+        return
+
+    conn = _connect(index_path)
+    try:
+        with conn:
+            _forget(conn, os.path.abspath(directory), stages)
+    finally:
+        conn.close()
+
+
+def clear(stage: str, index_path: str = STATUS_INDEX):
+    """Forget a stage for all directories (e.g., when it needs to be rerun)."""
+    if not index_path or not os.path.exists(index_path):
+        return
+
+    conn = _connect(index_path)
+    try:
+        with conn:
+            conn.execute("DELETE FROM status WHERE stage = ?", (stage,))
+    finally:
+        conn.close()
+
+
+def completed(stage: str, index_path: str = STATUS_INDEX):
+    """Return {directory: scalars} for the directories that finished a stage.
+
+    The results files are not checked, see ``get_scalars``.
+    """
+    if not index_path or not os.path.exists(index_path):
+        return dict()
+
+    conn = _connect(index_path)
+    try:
+        rows = conn.execute(
+            "SELECT directory, scalars FROM status WHERE stage = ?", (stage,)
+        ).fetchall()
+    finally:
+        conn.close()
+
+    return {directory: json.loads(scalars) for directory, scalars in rows}
+
+
+def get_scalars(
+    directory: str, stage: str, index_path: str = STATUS_INDEX, results_path: str = None
+):
+    """Return the scalars recorded for a finished stage, or None if it is not finished.
+
+    With ``results_path``, None is also returned if the results file is missing
+    or was changed outside of ``record`` (e.g., a new run in a recreated
+    directory), so the recorded scalars would be out of date. This only
+    compares the file size and modification time, so the file is not read.
+    """
+    if not index_path or not os.path.exists(index_path):
+        return None
+
+    conn = _connect(index_path)
+    try:
+        row = conn.execute(
+            "SELECT size, mtime_ns, scalars FROM status "
+            "WHERE directory = ? AND stage = ?",
+            (os.path.abspath(directory), stage),
+        ).fetchone()
+    finally:
+        conn.close()
+
+    if row is None:
+        return None
+
+    size, mtime_ns, scalars = row
+    if results_path is not None and size is not None:
+        if not os.path.isfile(results_path) or _file_stat(results_path) != (size, mtime_ns):
+            return None
+
+    return json.loads(scalars)
+
+
+def is_complete(
+    directory: str, stage: str, index_path: str = STATUS_INDEX, results_path: str = None
+):
+    return get_scalars(directory, stage, index_path, results_path) is not None
+
+
+def remaining(directories: list, stage: str, index_path: str = STATUS_INDEX):
+    """Return the directories that have not finished a stage."""
+    done = completed(stage, index_path)
+    return [d for d in directories if os.path.abspath(d) not in done]
+
+
+def summary(index_path: str = STATUS_INDEX):
+    """Return {stage: number of finished directories}."""
+    if not index_path or not os.path.exists(index_path):
+        return dict()
+
+    conn = _connect(index_path)
+    try:
+        rows = conn.execute(
+            "SELECT stage, COUNT(*) FROM status GROUP BY stage ORDER BY stage"
+        ).fetchall()
+    finally:
+        conn.close()
+
+    return dict(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--index_path", type=str, default=STATUS_INDEX)
+    args = parser.parse_args()
+
+    for stage, count in summary(args.index_path).items():
+        print(f"{stage: <45} {count}")
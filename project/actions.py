@@ -12,6 +12,8 @@ import json, datetime
 from pathlib import Path
 import numpy as np
 
+from plmnist import status
+
 # ┌──────────┐
 # │ NOTES    │
 # └──────────┘
@@ -41,6 +43,12 @@ if signac_directory.name != "project":
 analysis_directory = signac_directory / "analysis"
 output_file = analysis_directory / "output.txt"
 
+# The status index is updated by plmnist (via the environment variable) and by 
+# each action when it finishes, so the completion checks and analysis do not 
+# need to parse every 'results.json' file.
+status_index = str(signac_directory / "status.sqlite")
+os.environ["PLM_STATUS_INDEX"] = status_index
+
 
 # ┌─────────────────────────────────┐
 # │ Part 1 - write the job document │
@@ -50,8 +58,6 @@ def part_1_initialize_signac_command(*jobs):
     """Set the system's job parameters in the json file."""
 
     for job in jobs:
-        output_file.unlink(missing_ok=True)
-
         # here we write "signac_job_document.json" file.
         # signac takes care of the writing - we just add attributes to job.document
         # note that this file isn't used by the project - it's just here for demonstration.
@@ -60,6 +66,8 @@ def part_1_initialize_signac_command(*jobs):
         job.document.start_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
         job.document.seed = job.statepoint.seed_int
 
+        status.record(job.path, "part_1_initialize_signac_command", index_path=status_index)
+
 
 # ┌──────────────────────────────────┐
 # │ Part 2 - download the MNIST data │
@@ -97,6 +105,8 @@ def part_2_download_data_command(*jobs):
             )
             os.wait4(exec_make_completion_file.pid, os.WSTOPPED)
 
+            status.record(job.path, "part_2_download_data_command", index_path=status_index)
+
 
 # ┌──────────────────────────────────────────────┐
 # │ Part 3 - verify the main data is downloaded  │
@@ -120,6 +130,10 @@ def part_3_verify_main_data_downloaded_command(*jobs):
                 stderr=subprocess.STDOUT
             )
             os.wait4(exec_make_completion_file.pid, os.WSTOPPED)
+
+            status.record(
+                job.path, "part_3_verify_main_data_downloaded_command", index_path=status_index
+            )
                   
 
 # ┌──────────────────────────────────────┐
@@ -149,10 +163,31 @@ def part_4_train_and_test_command(*jobs):
             f"--dropout_prob {float(job.statepoint.dropout_prob_float)} "
             f"--seed {int(job.statepoint.seed_int)} "
             f"--fgsm_epsilon {float(job.statepoint.fgsm_epsilon_float)} "
+            f"--adv_epsilon {float(job.statepoint.adv_epsilon_float)} "
             f"--no_dhash "
             f"--no_fgsm "
         )
 
+        # Run CPU multi-process data-parallel (DDP with gloo) training when
+        # 'processes.per_directory' > 1 and no GPUs are set in the 'workflow.toml'.
+        # Lightning launches the local ranks itself, one per process.
+        num_processes = int(os.environ.get("ACTION_PROCESSES_PER_DIRECTORY", 1))
+        num_gpus = int(os.environ.get("ACTION_GPUS_PER_PROCESS", 0))
+        if num_processes > 1 and num_gpus == 0:
+            train_command += (
+                f"--accelerator cpu "
+                f"--devices {num_processes} "
+                f"--strategy ddp "
+            )
+
+        # the FGSM attack and seed analysis of a previous training run are
+        # out of date ('plmnist' also forgets its own 'fgsm' results)
+        status.forget(
+            job.path,
+            ["part_5_fgsm_attack_command", "part_6_seed_analysis_command"],
+            status_index,
+        )
+
         print(f"Running training/testing for {job}")
         exec_make_completion_file = subprocess.Popen(
                 train_command,
@@ -160,6 +195,14 @@ def part_4_train_and_test_command(*jobs):
                 stderr=subprocess.STDOUT
             )
         os.wait4(exec_make_completion_file.pid, os.WSTOPPED)
+
+        if job.isfile("results.json"):
+            status.record(
+                job.path,
+                "part_4_train_and_test_command",
+                job.fn("results.json"),
+                index_path=status_index,
+            )
         
 
 # ┌──────────────────────────────┐
@@ -170,8 +213,6 @@ def part_5_fgsm_attack_command(*jobs):
     """Run FGSM attack command."""
 
     for job in jobs:
-        output_file.unlink(missing_ok=True)
-
         fgsm_attack_command =  (
             f"python -m plmnist.fgsm "
             f"--seed {int(job.statepoint.seed_int)} "
@@ -187,22 +228,21 @@ def part_5_fgsm_attack_command(*jobs):
             )
         os.wait4(exec_make_completion_file.pid, os.WSTOPPED)
 
-        # Check if the training, testing, and writing and completed properly.
+        # Check if the training, testing, and writing and completed properly,
+        # using the values recorded in the status index when the fgsm results 
+        # were written (instead of loading the whole 'results.json' file), 
+        # if the 'results.json' file was not changed since then.
         passing_check_list = []
-        if job.isfile("results.json"):
-            with open(job.fn("results.json"), "r") as json_log_file:
-                try:
-                    loaded_json_file = json.load(json_log_file)
-                except json.decoder.JSONDecodeError:
+        fgsm_scalars = status.get_scalars(
+            job.path, "fgsm", status_index, job.fn("results.json")
+        )
+        if fgsm_scalars is None:
+            passing_check_list.append(False)
+        else:
+            for key in ["fgsm_acc", "test_loss", "test_acc"]:
+                if key not in fgsm_scalars:
                     passing_check_list.append(False)
 
-                for key in ["fgsm", "test_loss", "test_acc"]:
-                    if key not in loaded_json_file:
-                        passing_check_list.append(False)
-                    elif key == "fgsm":
-                        if "accuracy" not in loaded_json_file["fgsm"]:
-                            passing_check_list.append(False)
-
         # Write the completion file if the job finished correcty.
         if False not in passing_check_list:
             # Print completion file
@@ -213,6 +253,8 @@ def part_5_fgsm_attack_command(*jobs):
             )
             os.wait4(exec_make_completion_file.pid, os.WSTOPPED)
 
+            status.record(job.path, "part_5_fgsm_attack_command", index_path=status_index)
+
 
 # ┌─────────────────────────────────────┐
 # │ Part 6 - compute avg/std over seeds │
@@ -239,6 +281,7 @@ def part_6_seed_analysis_command(*jobs):
             "learning_rate_float".ljust(25),
             "dropout_prob_float".ljust(25),
             "fgsm_epsilon_float".ljust(25),
+            "adv_epsilon_float".ljust(25),
             "test_acc_avg".ljust(25),
             "test_acc_std_dev".ljust(25),
             "test_loss_avg".ljust(25),
@@ -261,39 +304,45 @@ def part_6_seed_analysis_command(*jobs):
 
     for job in jobs:  # only includes jobs of the same seed
         
-        # get the individual values
-        with open(job.fn("results.json"), "r") as json_log_file:
-            loaded_json_file = json.load(json_log_file)
-
-            test_acc_list.append(loaded_json_file["test_acc"])
-            test_loss_list.append(loaded_json_file["test_loss"])
-            val_acc_list.append(loaded_json_file["val_acc"])
-            val_loss_list.append(loaded_json_file["val_loss"])
-            fgsm_acc_list.append(loaded_json_file["fgsm"]["accuracy"])
-
-    output_file_obj.write(
-        " ".join( 
-            [
-                f"{job.statepoint.num_epochs_int: <25}",
-                f"{job.statepoint.batch_size_int: <25}",
-                f"{job.statepoint.hidden_size_int: <25}",
-                f"{job.statepoint.learning_rate_float: <25}",
-                f"{job.statepoint.dropout_prob_float: <25}",
-                f"{job.statepoint.fgsm_epsilon_float: <25}",
-                f"{np.mean(test_acc_list): <25}",
-                f"{np.std(test_acc_list, ddof=1): <25}",
-                f"{np.mean(test_loss_list): <25}",
-                f"{np.std(test_loss_list, ddof=1): <25}",
-                f"{np.mean(val_acc_list): <25}",
-                f"{np.std(val_acc_list, ddof=1): <25}",
-                f"{np.mean(val_loss_list): <25}",
-                f"{np.std(val_loss_list, ddof=1): <25}",
-                f"{np.mean(fgsm_acc_list): <25}",
-                f"{np.std(fgsm_acc_list, ddof=1): <25}",
-                "\n",
-            ]
+        # get the individual values from the status index, or the 
+        # 'results.json' file if they were not recorded there or are out of date
+        scalars = status.get_scalars(
+            job.path, "fgsm", status_index, job.fn("results.json")
         )
+        if scalars is None:
+            with open(job.fn("results.json"), "r") as json_log_file:
+                scalars = status.results_scalars(json.load(json_log_file))
+
+        test_acc_list.append(scalars["test_acc"])
+        test_loss_list.append(scalars["test_loss"])
+        val_acc_list.append(scalars["val_acc"])
+        val_loss_list.append(scalars["val_loss"])
+        fgsm_acc_list.append(scalars["fgsm_acc"])
+
+    output_line = " ".join( 
+        [
+            f"{job.statepoint.num_epochs_int: <25}",
+            f"{job.statepoint.batch_size_int: <25}",
+            f"{job.statepoint.hidden_size_int: <25}",
+            f"{job.statepoint.learning_rate_float: <25}",
+            f"{job.statepoint.dropout_prob_float: <25}",
+            f"{job.statepoint.fgsm_epsilon_float: <25}",
+            f"{job.statepoint.adv_epsilon_float: <25}",
+            f"{np.mean(test_acc_list): <25}",
+            f"{np.std(test_acc_list, ddof=1): <25}",
+            f"{np.mean(test_loss_list): <25}",
+            f"{np.std(test_loss_list, ddof=1): <25}",
+            f"{np.mean(val_acc_list): <25}",
+            f"{np.std(val_acc_list, ddof=1): <25}",
+            f"{np.mean(val_loss_list): <25}",
+            f"{np.std(val_loss_list, ddof=1): <25}",
+            f"{np.mean(fgsm_acc_list): <25}",
+            f"{np.std(fgsm_acc_list, ddof=1): <25}",
+            "\n",
+        ]
     )
+    output_file_obj.write(output_line)
+    output_file_obj.close()
 
     # Check that the replicate (seed) average file has been written and completed properly.
     passing_check_list = []
@@ -303,13 +352,9 @@ def part_6_seed_analysis_command(*jobs):
     with open(output_file, "r") as f:
         lines = f.readlines()
 
-    num_seeds = set()
-    for job in jobs:
-        num_seeds.add(int(job.statepoint.seed_int))
-
-    num_agg = len(jobs) / len(num_seeds)
-
-    if len(lines) != num_agg + 1:
+    # Other seed groups may have already been written to the same file,
+    # so check for this group's line.
+    if output_line not in lines:
         passing_check_list.append(False)
 
     # Write the completion file if the job finished correcty.
@@ -322,7 +367,60 @@ def part_6_seed_analysis_command(*jobs):
         )
         os.wait4(exec_make_completion_file.pid, os.WSTOPPED)
 
-    output_file_obj.close()
+        for group_job in jobs:
+            status.record(group_job.path, "part_6_seed_analysis_command", index_path=status_index)
+
+# ┌───────────────────────────────────────────────────────────┐
+# │ Optional - stacked evaluation of all the trained models   │
+# └───────────────────────────────────────────────────────────┘
+
+def stacked_evaluation_command(*jobs):
+    """Run the test and FGSM evaluation of all trained models in one pass over the test set.
+    
+    This can be used instead of Part 5, and is run locally for the whole project with:
+    python actions.py --action stacked_evaluation_command $(ls workspace)
+    """
+
+    # find all the trained models (the 'model.ckpt' files)
+    trained_jobs = [
+        job for job in jobs 
+        if job.statepoint.statepoint_type == "plmnist" and job.isfile("model.ckpt")
+    ]
+    if len(trained_jobs) == 0:
+        print("No trained models found.")
+        return
+
+    stacked_evaluation_command =  (
+        f"python -m plmnist.stacked "
+        f"{' '.join(job.fn('model.ckpt') for job in trained_jobs)} "
+        f"--fgsm_epsilon "
+        f"{' '.join(str(float(job.statepoint.fgsm_epsilon_float)) for job in trained_jobs)} "
+    )
+
+    print(f"Running the stacked evaluation for {len(trained_jobs)} jobs")
+    exec_stacked_evaluation = subprocess.Popen(
+            stacked_evaluation_command,
+            shell=True, 
+            stderr=subprocess.STDOUT
+        )
+    os.wait4(exec_stacked_evaluation.pid, os.WSTOPPED)
+
+    # Write the Part 5 completion file for the jobs that have the FGSM results.
+    for job in trained_jobs:
+        fgsm_scalars = status.get_scalars(
+            job.path, "fgsm", status_index, job.fn("results.json")
+        )
+
+        if fgsm_scalars is not None and "fgsm_acc" in fgsm_scalars:
+            exec_make_completion_file = subprocess.Popen(
+                f"touch {job.fn('fgsm_attack_complete.txt')}",
+                shell=True, 
+                stderr=subprocess.STDOUT
+            )
+            os.wait4(exec_make_completion_file.pid, os.WSTOPPED)
+
+            status.record(job.path, "part_5_fgsm_attack_command", index_path=status_index)
+
 
 # ┌───────────────────────────┐
 # │ ROW'S ENDING CODE SECTION │
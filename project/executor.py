@@ -0,0 +1,182 @@
+"""Local pipelined executor for the signac project (an alternative to 'row submit')."""
+# executor.py
+
+import argparse
+import concurrent.futures
+import signac
+
+import actions
+
+# ┌──────────┐
+# │ NOTES    │
+# └──────────┘
+
+# Instead of running the project stage by stage (all of Part 4, then all of
+# Part 5, ...), each job moves on to its next stage as soon as its own
+# dependencies are met.  Every stage has its own bounded number of workers,
+# so the CPU heavy FGSM attacks and analysis run alongside the training, and
+# a Part 6 seed group is run as soon as its last seed finishes Part 5.
+#
+# The stages are the same actions and product files as in the 'workflow.toml'
+# file, so the executor resumes correctly after a crash: any stage with an
+# existing product file is not rerun.  Stages that do not write their product
+# file are reported as failed and their dependent stages are skipped.
+#
+# Run it from the `project` directory, after 'python init.py':
+# python executor.py --train_workers 1 --fgsm_workers 4
+
+# ┌──────────────────────────────────────────────────┐
+# │ Stages, products, and dependencies (per job)     │
+# └──────────────────────────────────────────────────┘
+
+STAGES = {
+    "part_1_initialize_signac_command": "signac_job_document.json",
+    "part_2_download_data_command": "data_download_complete.txt",
+    "part_3_verify_main_data_downloaded_command": "ready_to_start_training.txt",
+    "part_4_train_and_test_command": "results.json",
+    "part_5_fgsm_attack_command": "fgsm_attack_complete.txt",
+    "part_6_seed_analysis_command": "avg_std_dev_calculated.txt",
+}
+
+# Part 6 groups all state points except the 'seed_int' (see 'sort_by' in the 'workflow.toml').
+SEED_GROUP_EXCLUDE = ("seed_int",)
+
+
+def seed_group_key(job):
+    return tuple(
+        sorted(
+            (key, value)
+            for key, value in job.statepoint.items()
+            if key not in SEED_GROUP_EXCLUDE
+        )
+    )
+
+
+def build_tasks(project):
+    """Return the tasks as {(stage, key): (jobs, dependencies)}."""
+    job_search = project.find_jobs({"statepoint_type": "main_data"})
+    assert len(job_search) == 1
+    main_data_job = [*job_search][0]
+
+    plmnist_jobs = list(project.find_jobs({"statepoint_type": "plmnist"}))
+
+    tasks = dict()
+    tasks[("part_2_download_data_command", main_data_job.id)] = ([main_data_job], [])
+
+    seed_groups = dict()
+    for job in plmnist_jobs:
+        tasks[("part_1_initialize_signac_command", job.id)] = ([job], [])
+        tasks[("part_3_verify_main_data_downloaded_command", job.id)] = (
+            [job],
+            [("part_2_download_data_command", main_data_job.id)],
+        )
+        tasks[("part_4_train_and_test_command", job.id)] = (
+            [job],
+            [("part_3_verify_main_data_downloaded_command", job.id)],
+        )
+        tasks[("part_5_fgsm_attack_command", job.id)] = (
+            [job],
+            [("part_4_train_and_test_command", job.id)],
+        )
+        seed_groups.setdefault(seed_group_key(job), []).append(job)
+
+    for group_key, group_jobs in seed_groups.items():
+        tasks[("part_6_seed_analysis_command", group_key)] = (
+            group_jobs,
+            [("part_5_fgsm_attack_command", job.id) for job in group_jobs],
+        )
+
+    return tasks
+
+
+def is_complete(stage, jobs):
+    # Part 6 only writes its product file in one job of the seed group.
+    return any(job.isfile(STAGES[stage]) for job in jobs)
+
+
+def run_task(stage, jobs):
+    getattr(actions, stage)(*jobs)
+    return is_complete(stage, jobs)
+
+
+# ┌──────────────────────────────┐
+# │ Pipelined scheduling loop    │
+# └──────────────────────────────┘
+
+def run(project, workers):
+    tasks = build_tasks(project)
+
+    # resume: the stages with existing product files are already done
+    done = {task for task, (jobs, _) in tasks.items() if is_complete(task[0], jobs)}
+    failed = set()
+    running = dict()
+    print(f"{len(done)} of {len(tasks)} tasks are already complete.")
+
+    pools = {
+        stage: concurrent.futures.ThreadPoolExecutor(max_workers=workers[stage])
+        for stage in STAGES
+    }
+
+    try:
+        while True:
+            # submit the ready tasks, up to the number of workers per stage
+            for task, (jobs, dependencies) in tasks.items():
+                stage = task[0]
+                if task in done or task in failed or task in running.values():
+                    continue
+                if any(dependency in failed for dependency in dependencies):
+                    failed.add(task)
+                    continue
+                if not all(dependency in done for dependency in dependencies):
+                    continue
+                in_flight = sum(1 for t in running.values() if t[0] == stage)
+                if in_flight >= workers[stage]:
+                    continue
+
+                running[pools[stage].submit(run_task, stage, jobs)] = task
+
+            if not running:
+                break
+
+            finished, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in finished:
+                task = running.pop(future)
+                try:
+                    completed = future.result()
+                except Exception as error:
+                    print(f"ERROR: {task[0]} for {task[1]} raised: {error}")
+                    completed = False
+
+                if completed:
+                    done.add(task)
+                else:
+                    print(f"ERROR: {task[0]} for {task[1]} did not write '{STAGES[task[0]]}'.")
+                    failed.add(task)
+    finally:
+        for pool in pools.values():
+            pool.shutdown(wait=True)
+
+    print(f"{len(done)} tasks complete, {len(failed)} tasks failed or skipped.")
+    return done, failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--setup_workers", type=int, default=4)
+    parser.add_argument("--train_workers", type=int, default=1)
+    parser.add_argument("--fgsm_workers", type=int, default=2)
+    args = parser.parse_args()
+
+    workers = {
+        "part_1_initialize_signac_command": args.setup_workers,
+        "part_2_download_data_command": 1,
+        "part_3_verify_main_data_downloaded_command": args.setup_workers,
+        "part_4_train_and_test_command": args.train_workers,
+        "part_5_fgsm_attack_command": args.fgsm_workers,
+        # all the seed groups append to the same analysis output file
+        "part_6_seed_analysis_command": 1,
+    }
+
+    run(signac.get_project(), workers)
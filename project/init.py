@@ -6,6 +6,8 @@ import signac
 import shutil
 import subprocess
 
+from plmnist import status
+
 
 # ┌───────────────────────────────────────────────┐
 # │ SET THE PROJECTS DEFAULT DIRECTORY AND PATHS  │
@@ -30,8 +32,27 @@ hidden_size_int_list = [64]
 learning_rate_float_list = [2e-4]
 dropout_prob_float_list = [ 0.1, 0.5] #[0.0, 0.1, 0.5]
 fgsm_epsilon_float_list = [0.05]
+adv_epsilon_float_list = [0.0] #[0.0, 0.05, 0.1] (0.0 = no adversarial training)
 seed_int_list = [1, 2] #[1, 2, 3]
 
+# ┌────────────────────────────────────────────────┐
+# │ Migrate state points from older workspaces     │
+# └────────────────────────────────────────────────┘
+
+# Jobs created before the 'adv_epsilon_float' state point was added were not 
+# adversarially trained, so they are given 'adv_epsilon_float = 0.0'.  Changing 
+# the state point moves the job to its new id, so its results are kept and 
+# the same job is not created again below.
+for job in list(project.find_jobs({"statepoint_type": plmnist_statpoint_type})):
+    if "adv_epsilon_float" not in job.statepoint:
+        try:
+            job.statepoint["adv_epsilon_float"] = 0.0
+        except signac.errors.DestinationExistsError:
+            print(
+                f"ERROR: Unable to migrate job {job.id}, as a job with "
+                f"'adv_epsilon_float = 0.0' and the same state point already exists."
+            )
+
 # ┌────────────────────────────────────────────────┐
 # │ Create and initiate plmnist statepoints        │
 # └────────────────────────────────────────────────┘
@@ -42,19 +63,21 @@ for num_epochs_int_i in num_epochs_int_list:
             for learning_rate_float_i in learning_rate_float_list:
                 for dropout_prob_float_i in dropout_prob_float_list:
                     for fgsm_epsilon_float_i in fgsm_epsilon_float_list:
-                        for seed_int_i in seed_int_list:
-                            statepoint = {
-                                "statepoint_type": plmnist_statpoint_type,
-                                "num_epochs_int": num_epochs_int_i,
-                                "batch_size_int": batch_size_int_i,
-                                "hidden_size_int": hidden_size_int_i,
-                                "learning_rate_float": learning_rate_float_i,
-                                "dropout_prob_float": dropout_prob_float_i,
-                                "fgsm_epsilon_float": fgsm_epsilon_float_i,
-                                "seed_int": seed_int_i,
-                            }
-
-                            project.open_job(statepoint=statepoint).init()
+                        for adv_epsilon_float_i in adv_epsilon_float_list:
+                            for seed_int_i in seed_int_list:
+                                statepoint = {
+                                    "statepoint_type": plmnist_statpoint_type,
+                                    "num_epochs_int": num_epochs_int_i,
+                                    "batch_size_int": batch_size_int_i,
+                                    "hidden_size_int": hidden_size_int_i,
+                                    "learning_rate_float": learning_rate_float_i,
+                                    "dropout_prob_float": dropout_prob_float_i,
+                                    "fgsm_epsilon_float": fgsm_epsilon_float_i,
+                                    "adv_epsilon_float": adv_epsilon_float_i,
+                                    "seed_int": seed_int_i,
+                                }
+
+                                project.open_job(statepoint=statepoint).init()
 
 # ┌─────────────────────────────────────────────────────┐
 # │ Define, create and initiate main data statepoints   │
@@ -101,6 +124,9 @@ try:
     )
     os.wait4(exec_delete_avg_std_dev_file.pid, os.WSTOPPED)
 
+    # Reset the seed analysis in the status index (see 'actions.py')
+    status.clear("part_6_seed_analysis_command", "status.sqlite")
+
     # Clean and reset row's completion status
     exec_reset_row_status = subprocess.Popen(
         "row clean --completed && row scan", 